@@ -1,9 +1,99 @@
 import pandas as pd
 import numpy as np
-import statsmodels.api as sm
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import njit, prange
+from scipy import linalg
+from scipy.special import expit
+from threadpoolctl import threadpool_limits
 
 from xgboost.sklearn import XGBClassifier
 
+
+def _one_hot(frame):
+    """
+    One-hot encode the categorical columns of a DataFrame into a float32 array.
+
+    Each categorical column is factorized once and its indicators are written
+    straight into the output array, so no intermediate dummy DataFrame is built.
+    Column names and order match `pd.get_dummies`.
+
+    Args:
+        frame: A pandas DataFrame containing the features.
+
+    Returns:
+        A tuple of a C-contiguous float32 array, with the numeric columns followed by
+        the indicator columns, and a list of its column names.
+    """
+    cat_cols = frame.select_dtypes(include=["object", "string", "category"]).columns
+    num = frame.drop(columns=cat_cols)
+    cats = [pd.Categorical(frame[c]) for c in cat_cols]
+
+    names = list(num.columns)
+    for c, cat in zip(cat_cols, cats):
+        names.extend(f"{c}_{v}" for v in cat.categories)
+
+    X = np.zeros((len(frame), len(names)), dtype=np.float32)
+    X[:, : num.shape[1]] = num.to_numpy(dtype=np.float32)
+
+    # set one indicator per row for each categorical column
+    offset = num.shape[1]
+    for cat in cats:
+        idx = np.flatnonzero(cat.codes >= 0)
+        X[idx, cat.codes[idx] + offset] = 1.0
+        offset += len(cat.categories)
+
+    return X, names
+
+
+@njit(parallel=True, cache=True)
+def _balance_all(X, w_t, w_c, out_t, out_c):
+    """
+    Compute weighted balance statistics for ATT weights across all columns.
+
+    Both weight vectors are normalized to sum to one within their group and are zero
+    outside it, so each mean is a single dot product with the column.
+
+    Args:
+        X: A 2D float array containing the predictor features.
+        w_t: An array of normalized weights for the treatment group.
+        w_c: An array of normalized ATT weights for the control group.
+        out_t: An array to hold the mean of each column in the treatment group.
+        out_c: An array to hold the weighted mean of each column in the control group.
+
+    Returns:
+        None.
+    """
+    n, k = X.shape
+    for j in prange(k):
+        sum_t = 0.0
+        sum_c = 0.0
+        for i in range(n):
+            sum_t += X[i, j] * w_t[i]
+            sum_c += X[i, j] * w_c[i]
+
+        out_t[j] = sum_t
+        out_c[j] = sum_c
+
+
+def _solve_block(U, tr_row, Yw):
+    """
+    Solve the weighted least-squares problem for a block of outcome variables.
+
+    Args:
+        U: The left singular vectors of the weighted design matrix.
+        tr_row: The treatment row of the pseudo-inverse of the weighted design matrix.
+        Yw: A 2D array of weighted outcome variables.
+
+    Returns:
+        A tuple of two arrays, representing the treatment coefficient and the sum of
+        squared residuals for each outcome variable.
+    """
+    UtY = U.T @ Yw
+    resid = Yw - U @ UtY
+
+    return tr_row @ UtY, (resid**2).sum(axis=0)
+
+
 class Benchmark:
     """
     Compare providers on benchmarks using propensity scores
@@ -21,9 +111,11 @@ class Benchmark:
     Attributes:
         model: A fitted propensity score model.
         pscore: A pandas Series containing the propensity scores.
-        wgt: A pandas Series containing the ATT weights.
-        Xpred: A pandas DataFrame containing the predictor features.
-        Xeval: A pandas DataFrame containing the evaluation features.
+        wgt: A numpy array containing the ATT weights.
+        Xpred: A float32 array containing the one-hot encoded predictor features.
+        Xeval: A float32 array containing the one-hot encoded evaluation features.
+        pred_columns: A list of column names for Xpred.
+        eval_columns: A list of column names for Xeval.
         outcomes: A list of estimated treatment effects for each outcome variable.
     """
     def __init__(self, data, focal_indicator, predictor_features, evaluation_features):
@@ -32,13 +124,21 @@ class Benchmark:
         self.pred_feat = predictor_features
         self.eval_feat = evaluation_features
 
+        # boolean treatment and control masks, reused by every method
+        self._tr_mask = np.asarray(focal_indicator, dtype=bool)
+        self._ctrl_mask = ~self._tr_mask
+
         self.model = None
         self.pscore = None
         self.wgt = None
 
+        # weighted design factorization, cached by fit for evaluate
+        self._sqrtw = None
+        self._svd = None
+
         # set up predictor and evaluation matrices
-        self.Xpred = pd.get_dummies(self.data[self.pred_feat])
-        self.Xeval = pd.get_dummies(self.data[self.eval_feat])
+        self.Xpred, self.pred_columns = _one_hot(self.data[self.pred_feat])
+        self.Xeval, self.eval_columns = _one_hot(self.data[self.eval_feat])
 
         # list to hold results
         self.outcomes = []
@@ -50,6 +150,8 @@ class Benchmark:
         Args:
             lrate: The learning rate of the model.
             nest: The number of estimators in the model.
+            **kwargs: Additional arguments passed to `XGBClassifier`. Trees are grown
+                with the binned histogram method unless `tree_method` is given.
 
         Returns:
             None.
@@ -58,64 +160,117 @@ class Benchmark:
         # set model params
         self.lrate = lrate
         self.nest = nest
+        kwargs.setdefault("tree_method", "hist")
 
         self.model = XGBClassifier(
             learning_rate=self.lrate, n_estimators=self.nest, **kwargs
         )
-        self.model.fit(self.Xpred, self.tr)
+        self.model.fit(self.Xpred, self._tr_mask)
 
         # define propensity scores and att weights
-        self.pscore = self.model.predict_proba(self.Xpred)[:, 1]
-        self.wgt = self._wt_att(y=self.tr, score=self.pscore)
+        self.pscore = self.model.predict(self.Xpred, output_margin=True)
+        expit(self.pscore, out=self.pscore)
+        self.wgt = self._wt_att(y=self._tr_mask, score=self.pscore)
+
+        # weighted design matrix with the treatment indicator as the last column,
+        # built in a single buffer
+        n, k = self.Xpred.shape
+        self._sqrtw = np.sqrt(self.wgt)
+        Xw = np.empty((n, k + 1), dtype=np.float64)
+        np.multiply(self.Xpred, self._sqrtw[:, None], out=Xw[:, :k])
+        np.multiply(self._tr_mask, self._sqrtw, out=Xw[:, -1])
+
+        # thin SVD of the weighted design, reused by every call to evaluate. It gives
+        # the minimum-norm solution for the rank-deficient dummy coding, along with
+        # the rank and the treatment variance term
+        U, sv, Vt = linalg.svd(
+            Xw, full_matrices=False, check_finite=False, lapack_driver="gesdd"
+        )
+        keep = sv > sv[0] * max(Xw.shape) * np.finfo(sv.dtype).eps
+        self._svd = (U[:, keep], sv[keep], Vt[keep])
 
-    def evaluate(self,digits=2):
+    def evaluate(self, digits=2, n_jobs=None):
         """
         Compute a difference-in-means estimate for the focal hospital.
 
-        This function uses a linear regression model to estimate the treatment effect
-        for the focal hospital. The model is fitted to the data from all hospitals,
+        This function uses a weighted linear regression model to estimate the treatment
+        effect for the focal hospital. The model is fitted to the data from all hospitals,
         with the focal hospital being the treatment group and all other hospitals being
         the control group. The difference in the mean of the outcome variable between
         the treatment and control groups is the estimated treatment effect.
 
         Args:
             digits: The number of digits to round the results to.
+            n_jobs: The number of parallel workers used to solve blocks of outcome
+                variables. By default all outcomes are solved in a single block.
 
         Returns:
             A list of estimated treatment effects for each outcome variable.
         """
 
-        Xtemp = self.Xpred.copy()
-        Xtemp['tr'] = self.tr
-        Xtemp = Xtemp.astype(float)
+        # every outcome shares the weighted design factored in fit
+        U, sv, Vt = self._svd
+        Yw = self.Xeval * self._sqrtw[:, None]
+
+        # treatment row of the pseudo-inverse of the weighted design
+        tr_row = Vt[:, -1] / sv
 
-        for i in self.Xeval.columns:
-            regr = sm.WLS(self.Xeval[i],Xtemp,weights=self.wgt).fit()
+        if n_jobs is None:
+            blocks = [_solve_block(U, tr_row, Yw)]
+        else:
+            # one BLAS thread per worker so the workers don't oversubscribe cores
+            splits = np.array_split(np.arange(Yw.shape[1]), effective_n_jobs(n_jobs))
+            with threadpool_limits(limits=1, user_api="blas"):
+                blocks = Parallel(n_jobs=n_jobs, prefer="threads")(
+                    delayed(_solve_block)(U, tr_row, Yw[:, idx]) for idx in splits
+                )
 
-            # get coefficient and se for treatment
-            res = round(regr.params['tr'],digits)
-            se_res = round(regr.bse['tr'],digits)
-            self.outcomes.append((res, se_res))
+        coef = np.concatenate([b[0] for b in blocks])
+        ssr = np.concatenate([b[1] for b in blocks])
+
+        # residual variance per outcome, scaled by the treatment term
+        df_resid = U.shape[0] - sv.size
+        sigma2 = ssr / df_resid
+        se = np.sqrt(sigma2 * (tr_row @ tr_row))
+
+        # get coefficient and se for treatment
+        res = np.round(coef, digits).tolist()
+        se_res = np.round(se, digits).tolist()
+        self.outcomes.extend(zip(res, se_res))
 
         return self.outcomes
 
-    def calc_balance(self):
+    def calc_balance(self, digits=2):
         """
-        Print balance statistics for all variables in the Xpred DataFrame.
+        Print balance statistics for all variables in the Xpred array.
 
-        This function calls the `_balance()` function to calculate the weighted balance
-        statistics for ATT weights. The results are printed to the console.
+        This function calls the `_balance_all()` kernel to calculate the weighted
+        balance statistics for ATT weights in a single pass over the predictors. The
+        results are printed to the console.
 
         Args:
-            None.
+            digits: The number of digits to round the results to.
 
         Returns:
             None.
         """
 
+        # column-major so each column is a contiguous sweep in the kernel
+        X = np.asfortranarray(self.Xpred)
+        # group totals are shared by every column, so normalize the weights once
+        w_t = self._tr_mask / self._tr_mask.sum()
+        w_c = np.where(self._ctrl_mask, self.wgt, 0.0)
+        w_c /= w_c.sum()
+
+        mf = np.empty(X.shape[1])
+        mc = np.empty(X.shape[1])
+        _balance_all(X, w_t, w_c, mf, mc)
+
+        mf = np.round(mf, digits).tolist()
+        mc = np.round(mc, digits).tolist()
+
         # TODO: Store a pandas dataframe with balance statistics
-        for v in self.Xpred.columns:
-            bal = self._balance(var=v, X=self.Xpred, tr=self.tr, wgt=self.wgt)
+        for v, bal in zip(self.pred_columns, zip(mf, mc)):
             print(f"{v}:{bal}")
 
     def _wt_att(self, y, score):
@@ -123,43 +278,18 @@ class Benchmark:
         Calculate Average Treatment Effect on the Treated (ATT) weights.
 
         Args:
-            y: A Series indicating the treatment group.
+            y: A boolean array indicating the treatment group.
             score: A Series of propensity scores.
 
         Returns:
-            A Series of ATT weights.
+            An array of ATT weights.
         """
-        weight = score / (1 - score)
+        # odds of treatment, computed in a single preallocated buffer
+        wt = np.empty(len(score), dtype=np.float64)
+        np.subtract(1.0, score, out=wt, dtype=np.float64)
+        np.divide(score, wt, out=wt, dtype=np.float64)
 
         # define att weights
-        wt = [1 if t == True else w for t, w in zip(y, weight)]
+        wt[y] = 1.0
 
         return wt
-
-    def _balance(self, var, X, tr, wgt, digits=2):
-        """
-        Compute weighted balance statistics for ATT weights
-
-        Args:
-            var: The name of the variable to be balanced.
-            X: A DataFrame containing the data.
-            tr: A boolean Series indicating the treatment group.
-            wgt: A Series of weights.
-            digits: The number of digits to round the results to.
-
-        Returns:
-            A tuple of two floats, representing the mean of the variable in the
-            treatment group and the weighted mean of the variable in the control group.
-        """
-
-        tab = X[var]
-
-        #
-        tf, tc = tab[tr], tab[~tr]
-        c_wgt = [v for v, c in zip(wgt, tr) if not c]
-
-        # compute average
-        mf = round(np.average(tf), digits)
-        mc = round(np.average(tc, weights=c_wgt), digits)
-
-        return (mf, mc)
\ No newline at end of file